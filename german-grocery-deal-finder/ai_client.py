@@ -1,11 +1,409 @@
-import google.generativeai as genai
+from google import genai
+from google.genai import types
+import asyncio
+import functools
+import hashlib
 import os
+import threading
+import unicodedata
 import json # For attempting to parse the AI's JSON response
+from collections import Counter, OrderedDict
+from collections.abc import Callable
+
+try:
+    import diskcache # Optional: persists cached AI results across restarts
+except ImportError:
+    diskcache = None
+
+try:
+    import orjson # Optional: faster JSON decoding/encoding of AI payloads
+except ImportError:
+    orjson = None
+
+try:
+    import ijson # Optional: incremental parsing of streamed extraction responses
+except ImportError:
+    ijson = None
+
+try:
+    from rapidfuzz import fuzz, process as fuzz_process # Optional: cheap lexical pre-matching
+except ImportError:
+    fuzz = fuzz_process = None
+
+try:
+    import numpy # Optional: lets RapidFuzz score all items against all names in one call (cdist)
+except ImportError:
+    numpy = None
+
+try:
+    from sentence_transformers import SentenceTransformer # Optional: local semantic matching
+except ImportError:
+    SentenceTransformer = None
 
 # It's good practice to load the API key from environment variables in a real app
 # For this example, it's passed as an argument.
 
-def get_ai_analysis(api_key: str, grocery_list: str, brochure_content: str) -> dict:
+MODEL_NAME = os.environ.get("GEMINI_MODEL", 'gemini-2.5-flash') # Must support structured (JSON schema) output
+MATCH_BATCH_SIZE = 25 # User items per bulk matching prompt; larger lists are split into several prompts
+CACHE_MAX_ENTRIES = 4096 # In-memory LRU size for cached AI results
+CACHE_DIR = os.environ.get("AI_CACHE_DIR", os.path.join(".cache", "ai_client"))
+CACHE_SIZE_LIMIT = 500 * 1024 * 1024 # Upper bound in bytes for the on-disk cache; diskcache evicts least recently used entries beyond it
+EMBEDDING_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+LOCAL_MATCH_THRESHOLD = 0.55 # Minimum cosine similarity to accept a local match without asking Gemini
+LOCAL_PERSIST_THRESHOLD = 0.85 # Local matches below this are only cached on disk if they pass _is_lexical_match
+# Local semantic matching runs when sentence-transformers is installed (requirements-local-matching.txt);
+# LOCAL_MATCHING=0 switches it off anyway
+LOCAL_MATCHING = SentenceTransformer is not None and os.environ.get("LOCAL_MATCHING", "1").lower() not in ("0", "false", "no")
+FUZZY_ACCEPT_SCORE = 90 # Minimum RapidFuzz WRatio score for a lexical match candidate; see _is_lexical_match
+FUZZY_MIN_ITEM_LENGTH = 4 # Shorter items (e.g. "Eis") fuzzy-match too many product names to be trusted
+
+EXTRACT_CHUNK_CHARS = 60000 # Brochure text longer than this is extracted in several concurrent requests
+
+_NO_MATCH = "NO_MATCH_FOUND"
+# Part of every match cache key; bumped when matching rules change so stale persisted matches are not served
+_MATCH_CACHE_VERSION = 2
+# Part of every extraction cache key; bump it whenever _EXTRACT_PROMPT or _EXTRACT_CONFIG changes
+_EXTRACT_CACHE_VERSION = 2
+
+# Structured output configs: the model is constrained to emit JSON of this shape, without code fences or prose
+_OFFERS_SCHEMA = types.Schema(
+    type=types.Type.ARRAY,
+    items=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "product_name": types.Schema(type=types.Type.STRING, description="Name as printed in the brochure"),
+            "price": types.Schema(type=types.Type.STRING, description='e.g. "2.99"'),
+            "unit": types.Schema(type=types.Type.STRING, description='Unit of the price, e.g. "kg", "Liter", "Packung"; "Stück" if per item'),
+            "offer_condition": types.Schema(type=types.Type.STRING, nullable=True, description='e.g. "Kaufe 2, zahle 1", "pro 100g"; null if none'),
+        },
+        required=["product_name", "price", "unit", "offer_condition"],
+    ),
+)
+_EXTRACT_CONFIG = types.GenerateContentConfig(response_mime_type="application/json", response_schema=_OFFERS_SCHEMA)
+_MATCH_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=types.Schema(
+        type=types.Type.OBJECT,
+        properties={"match": types.Schema(type=types.Type.STRING)},
+        required=["match"],
+    ),
+)
+# Bulk answers are keyed by the user's items, which a fixed schema cannot name, so only the MIME type is set
+_BULK_MATCH_CONFIG = types.GenerateContentConfig(response_mime_type="application/json")
+
+# Static offer extraction prompt; the brochure text is appended to it. Field formats live in
+# _OFFERS_SCHEMA, so the prompt needs no output example.
+_EXTRACT_PROMPT = (
+    "Extract every product offer from the grocery brochure below.\n"
+    "Fields: product_name, price, unit, offer_condition.\n"
+    "Return the JSON array only.\n\n"
+    "Brochure:\n"
+)
+_JSON_DECODER = json.JSONDecoder()
+_CLOSING = {'[': ']', '{': '}'}
+
+def _decode_json_payload(text: str, opening: str):
+    """
+    Decodes the first JSON value in text that starts with `opening` ('[' or '{'), in a single pass.
+    Markdown code fences or stray prose around the JSON are skipped rather than stripped.
+    Raises json.JSONDecodeError if no such value can be decoded.
+    """
+    start = text.find(opening)
+    if start == -1:
+        raise json.JSONDecodeError(f"No JSON value starting with '{opening}' found", text, 0)
+    if orjson is not None:
+        end = text.rfind(_CLOSING[opening])
+        if end > start:
+            try:
+                return orjson.loads(text[start:end + 1])
+            except orjson.JSONDecodeError:
+                pass # e.g. trailing prose containing a bracket; the stdlib decoder stops at the value's end
+    decoded, _ = _JSON_DECODER.raw_decode(text, start)
+    return decoded
+
+def _dumps(obj) -> str:
+    """Serializes obj to a JSON string for a prompt, keeping non-ASCII characters (umlauts) as-is."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False)
+
+def _prepare_matcher(extracted_offers: list[dict]) -> tuple[list[str], str, dict[str, dict]]:
+    """
+    Builds the per-brochure matching inputs once for a whole grocery list.
+
+    Returns:
+        (brochure_product_names, names_json, offers_by_name): the product names, their JSON
+        serialization for prompts, and a name -> offer lookup (the first offer wins on duplicate names).
+    """
+    brochure_product_names = [offer.get("product_name", "Unknown Product") for offer in extracted_offers]
+    offers_by_name = {}
+    for offer in extracted_offers:
+        offers_by_name.setdefault(offer.get("product_name"), offer)
+    return brochure_product_names, _dumps(brochure_product_names), offers_by_name
+
+# --- Client and event loop ---
+
+@functools.lru_cache(maxsize=4)
+def _get_client(api_key: str) -> genai.Client:
+    """
+    Returns a Gemini client per API key, reused across calls so its HTTP connections are pooled.
+    With aiohttp installed (google-genai[aiohttp]) the SDK runs client.aio requests on aiohttp,
+    natively on the event loop and without a connection limit. No 'transport' is passed in
+    async_client_args on purpose: a custom transport makes the SDK fall back to httpx.
+    """
+    return genai.Client(api_key=api_key)
+
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+def _run(coro):
+    """
+    Runs a coroutine on the module's background event loop and waits for its result.
+    Cached clients keep their async connections bound to the loop that opened them, so the
+    synchronous entry points share one long-lived loop instead of calling asyncio.run().
+    Raises RuntimeError when called on the loop's own thread (e.g. from an on_offer callback),
+    where waiting for the result would block the loop that has to produce it.
+    """
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="ai-client-loop", daemon=True)
+            _loop_thread.start()
+    if threading.current_thread() is _loop_thread:
+        coro.close() # Never scheduled; closing it avoids a "never awaited" warning
+        raise RuntimeError("Synchronous ai_client calls cannot be made from the ai-client-loop thread; await the async variant or schedule it on the loop instead.")
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+# --- End of client and event loop ---
+
+# --- Result cache ---
+# AI results are cached in a small in-process LRU, backed by a size-bounded diskcache when it is installed.
+# Extracted offers are keyed by a SHA-256 of the brochure text, so a repeated brochure never reaches the model.
+# Match results are keyed by (normalized user item, hash of the brochure product names) and store
+# only the matched product name, so they are resolved against whatever offer list is passed in.
+
+_memory_cache: OrderedDict = OrderedDict()
+_memory_cache_lock = threading.Lock()
+_disk_cache = diskcache.Cache(CACHE_DIR, size_limit=CACHE_SIZE_LIMIT, eviction_policy="least-recently-used") if diskcache else None
+
+def _cache_get(key: tuple):
+    with _memory_cache_lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            return _memory_cache[key]
+    if _disk_cache is None:
+        return None
+    value = _disk_cache.get(key)
+    if value is not None:
+        _cache_set(key, value, persist=False)
+    return value
+
+def _cache_set(key: tuple, value, persist: bool = True) -> None:
+    with _memory_cache_lock:
+        _memory_cache[key] = value
+        _memory_cache.move_to_end(key)
+        if len(_memory_cache) > CACHE_MAX_ENTRIES:
+            _memory_cache.popitem(last=False)
+    if persist and _disk_cache is not None:
+        _disk_cache.set(key, value)
+
+def _names_key(brochure_product_names: list[str]) -> str:
+    """
+    Hash identifying a brochure's product name list, computed once per brochure. BLAKE2b with a
+    16-byte digest is faster than SHA-1 on long name lists and short enough for a cache key.
+    """
+    return hashlib.blake2b("\n".join(sorted(brochure_product_names)).encode(), digest_size=16).hexdigest()
+
+def _item_key(user_item: str) -> str:
+    """Normalized spelling of a user item ("Tomaten", " tomaten " and full-width forms share one key)."""
+    return " ".join(unicodedata.normalize('NFKC', user_item).split()).lower()
+
+def _unique_items(user_items: list[str]) -> tuple[list[str], dict[str, str]]:
+    """
+    Returns the normalized key of every user item and a key -> first spelling mapping,
+    so each distinct item is matched once and the result is mapped back to all its spellings.
+    """
+    item_keys = [_item_key(user_item) for user_item in user_items]
+    representatives = {}
+    for item_key, user_item in zip(item_keys, user_items):
+        representatives.setdefault(item_key, user_item)
+    return item_keys, representatives
+
+def _content_hash(brochure_content: str) -> str:
+    return hashlib.sha256(brochure_content.encode()).hexdigest()
+
+def _offers_key(content_hash: str) -> tuple:
+    """Cache key for the offers extracted from a brochure's text, given its _content_hash."""
+    return ("offers", _EXTRACT_CACHE_VERSION, MODEL_NAME, content_hash)
+
+def _copy_offers(offers: list) -> list:
+    return [dict(offer) if isinstance(offer, dict) else offer for offer in offers]
+
+def _match_key(user_item: str, names_key: str) -> tuple:
+    return ("match", _MATCH_CACHE_VERSION, _item_key(user_item), names_key)
+
+def _cache_match(user_item: str, names_key: str, result: dict | None, persist: bool = True) -> None:
+    """
+    Remembers a successful match (or an explicit no-match); errors are not cached.
+    With persist=False the match is only kept in memory, not written to the disk cache.
+    """
+    if result is None:
+        _cache_set(_match_key(user_item, names_key), _NO_MATCH, persist=persist)
+    elif result.get("status") != "error":
+        _cache_set(_match_key(user_item, names_key), result.get("product_name"), persist=persist)
+
+# --- End of result cache ---
+
+# --- Lexical pre-filter ---
+
+_GERMAN_ARTICLES = frozenset({"der", "die", "das", "den", "dem", "des", "ein", "eine", "einen", "einem", "einer"})
+
+def _normalize_for_fuzzy(text: str) -> str:
+    """Lowercases, strips diacritics (ä -> a) and German articles so lexical scores compare the nouns."""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(word for word in stripped.split() if word not in _GERMAN_ARTICLES)
+
+def _is_lexical_match(normalized_item: str, normalized_name: str) -> bool:
+    """
+    True if every word of the item is a word of the name or the end of a compound in it ("tomaten" in
+    "bio rispentomaten", "milch" in "frische vollmilch"). WRatio scores any substring at 90, so a high
+    score alone would also accept "reis" -> "preiselbeeren" or "butter" -> "butterkekse".
+    """
+    name_words = normalized_name.split()
+    return all(any(name_word.endswith(item_word) for name_word in name_words) for item_word in normalized_item.split())
+
+def _normalize_names_for_fuzzy(brochure_product_names: list[str]) -> list[str] | None:
+    """Normalized product names for _resolve_fuzzy, built once per brochure; None without RapidFuzz."""
+    if fuzz is None:
+        return None
+    return [_normalize_for_fuzzy(name) for name in brochure_product_names]
+
+def _resolve_fuzzy(pending_items: list[str], normalized_names: list[str] | None, names_key: str, extracted_offers: list[dict], results: dict) -> list[str]:
+    """
+    Accepts obvious lexical matches (e.g. "Tomaten" -> "Bio Rispentomaten") with RapidFuzz and returns the
+    items that still need a semantic match: the best-scoring name that passes _is_lexical_match wins.
+    Low scores are not treated as "no match", because synonyms such as "Semmel" / "Weizenbrötchen"
+    share few characters. Lexical matches are cached in memory only, never on disk.
+    With numpy installed, all items are scored against all names in one multi-threaded cdist call.
+    """
+    if normalized_names is None or not pending_items:
+        return pending_items
+    candidates = []
+    unresolved_items = []
+    for user_item in pending_items:
+        normalized_item = _normalize_for_fuzzy(user_item)
+        if len(normalized_item) >= FUZZY_MIN_ITEM_LENGTH:
+            candidates.append((user_item, normalized_item))
+        else:
+            unresolved_items.append(user_item)
+    if not candidates:
+        return unresolved_items
+
+    if numpy is not None:
+        # Scores below the cutoff come back as 0; each row's remaining names are tried best score first
+        scores = fuzz_process.cdist([normalized_item for _, normalized_item in candidates], normalized_names,
+                                    scorer=fuzz.WRatio, score_cutoff=FUZZY_ACCEPT_SCORE, workers=-1)
+        best_indices = []
+        for row, (_, normalized_item) in enumerate(candidates):
+            row_scores = scores[row]
+            ranked = (int(index) for index in numpy.argsort(-row_scores, kind="stable") if row_scores[index] > 0)
+            best_indices.append(next((index for index in ranked if _is_lexical_match(normalized_item, normalized_names[index])), None))
+    else:
+        best_indices = []
+        for _, normalized_item in candidates:
+            ranked = fuzz_process.extract(normalized_item, normalized_names, scorer=fuzz.WRatio, score_cutoff=FUZZY_ACCEPT_SCORE, limit=None)
+            best_indices.append(next((index for _, _, index in ranked if _is_lexical_match(normalized_item, normalized_names[index])), None))
+
+    for (user_item, _), best_index in zip(candidates, best_indices):
+        if best_index is None:
+            unresolved_items.append(user_item)
+        else:
+            offer = extracted_offers[best_index]
+            _cache_match(user_item, names_key, offer, persist=False)
+            results[user_item] = offer
+    return unresolved_items
+
+# --- End of lexical pre-filter ---
+
+# --- Local embedding matcher ---
+
+@functools.lru_cache(maxsize=1)
+def _get_embedding_model():
+    """Loads the sentence-transformer once, on first use rather than at import."""
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+def _get_brochure_embeddings(brochure_product_names: list[str], names_key: str):
+    embeddings = _cache_get(("embeddings", names_key))
+    if embeddings is None:
+        embeddings = _get_embedding_model().encode(brochure_product_names, normalize_embeddings=True)
+        _cache_set(("embeddings", names_key), embeddings, persist=False)
+    return embeddings
+
+def match_items_local(user_items: list[str], extracted_offers: list[dict], threshold: float = LOCAL_MATCH_THRESHOLD) -> tuple[dict[str, dict], list[str]]:
+    """
+    Matches user items to brochure offers with local multilingual sentence embeddings,
+    so that clear matches do not need a Gemini request.
+
+    Args:
+        user_items: The grocery item strings from the user's list.
+        extracted_offers: A list of offer dictionaries (previously extracted by get_ai_analysis).
+        threshold: Minimum cosine similarity for a local match to be accepted.
+
+    Returns:
+        A tuple (matches, unresolved_items). matches maps user items to their offer dictionary;
+        unresolved_items are the items whose best score was below the threshold and that should
+        be sent to Gemini. If local matching is off (see LOCAL_MATCHING), every item is unresolved.
+    """
+    if not LOCAL_MATCHING or not user_items or not extracted_offers:
+        return {}, list(user_items)
+
+    brochure_product_names = [offer.get("product_name", "Unknown Product") for offer in extracted_offers]
+    brochure_embeddings = _get_brochure_embeddings(brochure_product_names, _names_key(brochure_product_names))
+    matches, unresolved_items, _ = _match_local(user_items, brochure_embeddings, extracted_offers, threshold)
+    return matches, unresolved_items
+
+def _match_local(user_items: list[str], brochure_embeddings, extracted_offers: list[dict], threshold: float) -> tuple[dict[str, dict], list[str], dict[str, float]]:
+    """match_items_local on precomputed brochure embeddings; also returns the similarity of each match."""
+    user_embeddings = _get_embedding_model().encode(user_items, normalize_embeddings=True)
+
+    # Embeddings are normalized, so a single matrix product gives all cosine similarities
+    scores = user_embeddings @ brochure_embeddings.T
+    best_indices = scores.argmax(axis=1)
+
+    matches = {}
+    match_scores = {}
+    unresolved_items = []
+    for row, (user_item, best_index) in enumerate(zip(user_items, best_indices)):
+        if scores[row, best_index] >= threshold:
+            matches[user_item] = extracted_offers[best_index]
+            match_scores[user_item] = float(scores[row, best_index])
+        else:
+            unresolved_items.append(user_item)
+    return matches, unresolved_items, match_scores
+
+def _is_confident_local_match(user_item: str, offer: dict, score: float) -> bool:
+    """
+    True if a local match may be persisted: it clears LOCAL_PERSIST_THRESHOLD or passes _is_lexical_match.
+    Near the acceptance threshold embeddings also pair compounds such as "Butter" -> "Butterkekse".
+    """
+    return score >= LOCAL_PERSIST_THRESHOLD or _is_lexical_match(
+        _normalize_for_fuzzy(user_item), _normalize_for_fuzzy(offer.get("product_name", "")))
+
+# --- End of local embedding matcher ---
+
+def get_ai_analysis(api_key: str, grocery_list: str, brochure_content: str, on_offer: Callable[[dict], None] | None = None) -> dict:
+    """
+    Synchronous wrapper around get_ai_analysis_async, kept for existing callers.
+    Note that on_offer, if given, is called from the module's background event loop thread;
+    see get_ai_analysis_async for what it may do there.
+    """
+    return _run(get_ai_analysis_async(api_key, grocery_list, brochure_content, on_offer))
+
+
+async def get_ai_analysis_async(api_key: str, grocery_list: str, brochure_content: str, on_offer: Callable[[dict], None] | None = None) -> dict:
     """
     Analyzes brochure content to extract all product offers using Google Gemini API.
     The grocery_list parameter is currently not used in the prompt for this function,
@@ -15,78 +413,83 @@ def get_ai_analysis(api_key: str, grocery_list: str, brochure_content: str) -> d
         api_key: The Google Gemini API key.
         grocery_list: A string containing the user's grocery list (currently unused by the prompt).
         brochure_content: A string containing the text content of the grocery brochure.
+        on_offer: Optional callback. If given, the response is streamed and each offer is passed
+                  to on_offer as soon as it has been generated, so callers can start working on
+                  offers before the whole array is complete. It runs on the event loop that
+                  every Gemini request shares, so it must not block: only enqueue work there
+                  (e.g. hand the offer to a queue, or schedule Matcher.match_many_async as a
+                  task). Calling a synchronous entry point from it raises RuntimeError.
 
     Returns:
-        A dictionary containing the AI's response (ideally a JSON string of offers)
-        or an error message.
+        A dictionary containing the parsed list of offer dictionaries ("offers"), or an error message.
+        A freshly generated result also carries the AI's raw response text ("ai_response") for
+        debugging; it is not cached, so results served from the cache omit it.
+        Successful results are cached (on disk when diskcache is installed) by a hash of
+        brochure_content, the model name and the prompt version, so repeated brochures skip the
+        model entirely.
     """
+    cache_key = _offers_key(_content_hash(brochure_content))
+    # Off the shared event loop: the disk cache is SQLite and would stall every concurrent request
+    cached_result = await asyncio.to_thread(_cache_get, cache_key)
+    if cached_result is not None:
+        # Hand out fresh offer dicts so callers can annotate them without touching the cache
+        result = dict(cached_result, offers=_copy_offers(cached_result["offers"]))
+        if on_offer is not None:
+            for offer in result["offers"]:
+                on_offer(offer)
+        return result
+
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(model_name='gemini-pro')
+        client = _get_client(api_key)
+    except ValueError as ve:
+        return {"status": "error", "message": f"API Key configuration error during offer extraction: {str(ve)}"}
 
-        prompt = f"""
-        You are a specialized data extraction assistant. Your task is to scan the provided grocery brochure content
-        and identify all distinct product offers. For each offer, extract the following details:
-        - product_name: The name of the product as it appears in the brochure.
-        - price: The price of the product (e.g., "2.99", "1.45", "0.89").
-        - unit: The unit associated with the price (e.g., "kg", "Stück", "Packung", "Liter", "g", "ml", "Bund", "Netz", "Schale"). If the price is per item or pack, common units are "Stück" or "Packung". If no unit is explicitly mentioned but implied (e.g. for a single item like a bottle of soda), use "Stück".
-        - offer_condition: Any special conditions or notes related to the offer, such as "Kaufe 2, zahle 1", "Ab 3 Packungen X€", "pro 100g", "nur gültig am [Datum/Tag]", "solange der Vorrat reicht". If no special condition is mentioned, use null or an empty string.
-
-        The brochure content is as follows:
-        --- BROCHURE CONTENT START ---
-        {brochure_content}
-        --- BROCHURE CONTENT END ---
-
-        Return your findings as a single JSON array of objects. Each object in the array should represent one product offer.
-        Do NOT include any text or explanations outside of the JSON array itself.
-
-        Example of the desired JSON output format:
-        [
-          {{
-            "product_name": "Rispentomaten",
-            "price": "1.99",
-            "unit": "kg",
-            "offer_condition": null
-          }},
-          {{
-            "product_name": "Frische Vollmilch 3.5%",
-            "price": "0.95",
-            "unit": "Liter",
-            "offer_condition": "Beim Kauf von 2 Stück nur 1.80€"
-          }}
-        ]
-        
-        Ensure the output is a valid JSON array.
-        """
-        
-        response = model.generate_content(prompt)
-        
-        ai_response_text = None
-        if hasattr(response, 'text') and response.text:
-            ai_response_text = response.text
-        elif response.parts:
-            ai_response_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
+    # Large brochures are extracted in parts concurrently and the offer arrays merged
+    brochure_parts = _split_brochure_content(brochure_content)
+    part_results = await asyncio.gather(*[_extract_offers(client, part, on_offer) for part in brochure_parts])
+    for part_result in part_results:
+        if part_result.get("status") != "success":
+            return part_result
+
+    if len(part_results) == 1:
+        result = part_results[0]
+    else:
+        offers = [offer for part_result in part_results for offer in part_result["offers"]]
+        result = {"status": "success", "offers": offers, "ai_response": "\n".join(part_result["ai_response"] for part_result in part_results)}
+    await asyncio.to_thread(_cache_set, cache_key, {"status": "success", "offers": _copy_offers(result["offers"])})
+    return result
+
+
+def _split_brochure_content(brochure_content: str) -> list[str]:
+    """
+    Splits brochure text into parts of at most EXTRACT_CHUNK_CHARS characters, cutting at line
+    breaks (PDF pages are joined by newlines) so that no offer line is split in two.
+    """
+    parts = []
+    start = 0
+    while len(brochure_content) - start > EXTRACT_CHUNK_CHARS:
+        cut = brochure_content.rfind("\n", start, start + EXTRACT_CHUNK_CHARS)
+        if cut <= start:
+            cut = start + EXTRACT_CHUNK_CHARS # A single very long line; cut it hard
+        parts.append(brochure_content[start:cut])
+        start = cut
+    parts.append(brochure_content[start:])
+    return parts
+
+
+async def _extract_offers(client: genai.Client, brochure_content: str, on_offer: Callable[[dict], None] | None = None) -> dict:
+    """
+    Runs the offer extraction prompt over one part of the brochure.
+    """
+    try:
+        # The static instructions are a module constant; only the brochure text is appended
+        prompt = _EXTRACT_PROMPT + brochure_content
+
+        if on_offer is not None and ijson is not None:
+            return await _extract_offers_streaming(client, prompt, on_offer)
         
-        if ai_response_text:
-            if ai_response_text.strip().startswith("```json"):
-                ai_response_text = ai_response_text.strip()[7:]
-                if ai_response_text.strip().endswith("```"):
-                    ai_response_text = ai_response_text.strip()[:-3]
-            try:
-                json.loads(ai_response_text) 
-                return {"status": "success", "ai_response": ai_response_text}
-            except json.JSONDecodeError as je:
-                return {
-                    "status": "error", 
-                    "message": "AI response from offer extraction was not valid JSON.", 
-                    "ai_raw_response": ai_response_text,
-                    "details": str(je)
-                }
-        else:
-            feedback = str(response.prompt_feedback) if hasattr(response, 'prompt_feedback') else "No feedback available."
-            if response.candidates and response.candidates[0].finish_reason.name != "STOP":
-                 feedback += f" Finish Reason: {response.candidates[0].finish_reason.name}"
-            return {"status": "error", "message": "AI offer extraction response format not recognized or empty.", "details": feedback}
+        response = await client.aio.models.generate_content(model=MODEL_NAME, contents=prompt, config=_EXTRACT_CONFIG)
+        return _parse_offers_response(response, on_offer)
 
     except ValueError as ve:
         return {"status": "error", "message": f"API Key configuration error during offer extraction: {str(ve)}"}
@@ -97,30 +500,493 @@ def get_ai_analysis(api_key: str, grocery_list: str, brochure_content: str) -> d
         return {"status": "error", "message": error_message}
 
 
-def match_item_to_brochure_offers(api_key: str, user_item: str, extracted_offers: list[dict]) -> dict | None:
+def _parse_offers_response(response, on_offer: Callable[[dict], None] | None = None) -> dict:
+    """
+    Turns a (non-streamed) extraction response into the result dictionary returned by get_ai_analysis.
+    """
+    ai_response_text = None
+    if hasattr(response, 'text') and response.text:
+        ai_response_text = response.text
+    elif response.parts:
+        ai_response_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
+    
+    if ai_response_text:
+        try:
+            offers = _decode_json_payload(ai_response_text, '[')
+            if on_offer is not None: # Streaming requested, but ijson is not installed
+                for offer in offers:
+                    on_offer(offer)
+            return {"status": "success", "offers": offers, "ai_response": ai_response_text}
+        except json.JSONDecodeError as je:
+            return {
+                "status": "error", 
+                "message": "AI response from offer extraction was not valid JSON.", 
+                "ai_raw_response": ai_response_text,
+                "details": str(je)
+            }
+    else:
+        feedback = str(response.prompt_feedback) if hasattr(response, 'prompt_feedback') else "No feedback available."
+        if response.candidates and response.candidates[0].finish_reason and response.candidates[0].finish_reason.name != "STOP":
+             feedback += f" Finish Reason: {response.candidates[0].finish_reason.name}"
+        return {"status": "error", "message": "AI offer extraction response format not recognized or empty.", "details": feedback}
+
+
+async def _extract_offers_streaming(client: genai.Client, prompt: str, on_offer: Callable[[dict], None]) -> dict:
+    """
+    Streams the extraction response and parses it incrementally with ijson, passing every offer
+    to on_offer as soon as its object is complete. If the stream cannot be parsed incrementally
+    (e.g. a trailing code fence), the full text is decoded at the end and only the offers not
+    yet delivered are passed on.
+    """
+    text_parts = []
+    streamed_offers = []
+    parsed_items = ijson.sendable_list()
+    parser = ijson.items_coro(parsed_items, 'item', use_float=True)
+    array_started = False
+    parser_ok = True
+
+    def deliver_parsed_items():
+        for offer in parsed_items:
+            streamed_offers.append(offer)
+            on_offer(offer)
+        del parsed_items[:]
+
+    async for chunk in await client.aio.models.generate_content_stream(model=MODEL_NAME, contents=prompt, config=_EXTRACT_CONFIG):
+        chunk_text = chunk.text or ""
+        text_parts.append(chunk_text)
+        if not parser_ok:
+            continue
+        if not array_started:
+            start = chunk_text.find('[') # Skip a leading code fence or prose
+            if start == -1:
+                continue
+            chunk_text = chunk_text[start:]
+            array_started = True
+        try:
+            parser.send(chunk_text.encode())
+        except ijson.JSONError:
+            parser_ok = False
+        deliver_parsed_items()
+
+    if parser_ok and array_started:
+        try:
+            parser.close()
+        except ijson.JSONError:
+            parser_ok = False
+        deliver_parsed_items()
+
+    ai_response_text = "".join(text_parts)
+    if not ai_response_text:
+        return {"status": "error", "message": "AI offer extraction response format not recognized or empty.", "details": "Empty streamed response."}
+    if parser_ok and array_started:
+        return {"status": "success", "offers": streamed_offers, "ai_response": ai_response_text}
+
+    try:
+        offers = _decode_json_payload(ai_response_text, '[')
+    except json.JSONDecodeError as je:
+        return {
+            "status": "error", 
+            "message": "AI response from offer extraction was not valid JSON.", 
+            "ai_raw_response": ai_response_text,
+            "details": str(je)
+        }
+    for offer in offers[len(streamed_offers):]:
+        on_offer(offer)
+    return {"status": "success", "offers": streamed_offers + offers[len(streamed_offers):], "ai_response": ai_response_text}
+
+
+# --- Batch extraction ---
+# Gemini Batch Mode runs requests asynchronously at a lower price and higher rate limits, at the
+# cost of latency (jobs may take minutes to hours). get_ai_analysis stays the interactive path;
+# bulk and back-office extraction of many brochures goes through submit/poll below.
+
+_BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"}
+_BATCH_FAILED_STATES = {"JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+# Per-request metadata only exists in newer google-genai releases (and is echoed back in responses
+# later still); without it, responses are mapped back to brochures by request order.
+_BATCH_METADATA = "metadata" in getattr(getattr(types, "InlinedRequest", None), "model_fields", {})
+
+def submit_brochures_batch(api_key: str, brochures: list[str]) -> dict:
+    """
+    Submits offer extraction for many brochures as one Gemini batch job with inline requests.
+
+    Args:
+        api_key: The Google Gemini API key.
+        brochures: The text content of each brochure.
+
+    Returns:
+        A dictionary with the batch job's name ("job_name"), the brochure index of every request
+        ("request_brochures") and each brochure's cache key ("content_keys"), to pass to poll_batch;
+        or an error message.
+    """
+    try:
+        client = _get_client(api_key)
+        inlined_requests = []
+        request_brochures = []
+        content_keys = []
+        for index, brochure_content in enumerate(brochures):
+            content_keys.append(_content_hash(brochure_content))
+            # Each request is tagged with its brochure (if the SDK supports it) so split brochures can be merged back
+            extra = {"metadata": {"brochure": str(index), "content_key": content_keys[index]}} if _BATCH_METADATA else {}
+            for part in _split_brochure_content(brochure_content):
+                inlined_requests.append(types.InlinedRequest(
+                    model=MODEL_NAME,
+                    contents=_EXTRACT_PROMPT + part,
+                    config=_EXTRACT_CONFIG,
+                    **extra,
+                ))
+                request_brochures.append(index)
+        batch_job = client.batches.create(
+            model=MODEL_NAME,
+            src=inlined_requests,
+            config=types.CreateBatchJobConfig(display_name=f"brochure-extraction-{len(brochures)}"),
+        )
+        return {
+            "status": "success", "job_name": batch_job.name, "request_count": len(inlined_requests),
+            "request_brochures": request_brochures, "content_keys": content_keys,
+        }
+    except ValueError as ve:
+        return {"status": "error", "message": f"API Key configuration error during batch submission: {str(ve)}"}
+    except Exception as e:
+        error_message = f"An unexpected error occurred with the AI service during batch submission: {str(e)}"
+        if hasattr(e, 'message'): 
+             error_message = f"AI service error (batch submission): {e.message}"
+        return {"status": "error", "message": error_message}
+
+
+def poll_batch(api_key: str, job_name: str, request_brochures: list[int] | None = None, content_keys: list[str] | None = None) -> dict:
+    """
+    Checks a batch job created by submit_brochures_batch. Pass its "request_brochures" and
+    "content_keys" so that responses can be mapped to brochures (and cached) even with SDK
+    versions that do not return per-request metadata; without them and without metadata, every
+    request is assumed to be a whole brochure.
+
+    Returns:
+        {"status": "pending", "state": ...} while the job runs, an error message if it failed, or
+        {"status": "success", "results": [...]} with one get_ai_analysis-style result per brochure,
+        in submission order; a brochure whose responses are missing gets an error result. Successful results are cached, so a later get_ai_analysis call for
+        the same brochure is answered without calling the model.
+    """
+    try:
+        client = _get_client(api_key)
+        batch_job = client.batches.get(name=job_name)
+    except ValueError as ve:
+        return {"status": "error", "message": f"API Key configuration error while polling batch: {str(ve)}"}
+    except Exception as e:
+        error_message = f"An unexpected error occurred with the AI service while polling batch: {str(e)}"
+        if hasattr(e, 'message'): 
+             error_message = f"AI service error (batch polling): {e.message}"
+        return {"status": "error", "message": error_message}
+
+    state = batch_job.state.name if batch_job.state else "JOB_STATE_UNSPECIFIED"
+    if state in _BATCH_FAILED_STATES:
+        return {"status": "error", "message": f"Batch job ended with state {state}.", "details": str(batch_job.error)}
+    if state not in _BATCH_DONE_STATES:
+        return {"status": "pending", "state": state}
+    if not batch_job.dest or batch_job.dest.inlined_responses is None:
+        return {"status": "error", "message": "Batch job finished without inline responses."}
+
+    # Group the part results per brochure; responses come back in request order
+    part_results_by_brochure: dict[int, list[dict]] = {}
+    brochure_keys = {}
+    try:
+        for position, inlined_response in enumerate(batch_job.dest.inlined_responses):
+            metadata = getattr(inlined_response, "metadata", None) or {}
+            if "brochure" in metadata:
+                index = int(metadata["brochure"])
+            elif request_brochures is not None:
+                index = request_brochures[position]
+            else:
+                index = position
+            brochure_keys[index] = metadata.get("content_key") or (content_keys[index] if content_keys else None)
+            if inlined_response.error is not None:
+                part_result = {"status": "error", "message": "Batch request failed.", "details": str(inlined_response.error)}
+            elif inlined_response.response is None:
+                part_result = {"status": "error", "message": "Batch job returned no response for this brochure."}
+            else:
+                part_result = _parse_offers_response(inlined_response.response)
+            part_results_by_brochure.setdefault(index, []).append(part_result)
+    except (IndexError, ValueError) as e:
+        return {"status": "error", "message": "Batch responses could not be mapped to brochures.", "details": str(e)}
+
+    # One result per submitted brochure, so results stay aligned even if a response is missing
+    if content_keys is not None:
+        brochure_count = len(content_keys)
+    elif request_brochures:
+        brochure_count = max(request_brochures) + 1
+    else:
+        brochure_count = max(part_results_by_brochure, default=-1) + 1
+    expected_parts = Counter(request_brochures) if request_brochures is not None else None
+    results = []
+    for index in range(brochure_count):
+        part_results = part_results_by_brochure.get(index, [])
+        if len(part_results) < (expected_parts[index] if expected_parts is not None else 1):
+            results.append({"status": "error", "message": "Batch job returned no response for this brochure."})
+            continue
+        failed = next((part_result for part_result in part_results if part_result.get("status") != "success"), None)
+        if failed is not None:
+            results.append(failed)
+            continue
+        offers = [offer for part_result in part_results for offer in part_result["offers"]]
+        if brochure_keys.get(index):
+            _cache_set(_offers_key(brochure_keys[index]), {"status": "success", "offers": _copy_offers(offers)})
+        results.append({"status": "success", "offers": offers})
+    return {"status": "success", "results": results}
+
+# --- End of batch extraction ---
+
+
+# --- Matcher ---
+
+class Matcher:
+    """
+    Holds the per-brochure state used for matching: the product names, their JSON for prompts,
+    the name -> offer lookup, the cache key, the normalized names for the lexical pre-filter,
+    the Gemini client and (loaded on first use) the local embeddings. Build one per brochure
+    and reuse it for every item instead of recomputing it per call.
+
+    Usage:
+        matcher = Matcher(extracted_offers, api_key)
+        results = matcher.match_many(["Tomaten", "Milch"])
+    """
+
+    def __init__(self, extracted_offers: list[dict], api_key: str):
+        self.extracted_offers = extracted_offers
+        self.api_key = api_key
+        self.names, self.names_json, self.offers_by_name = _prepare_matcher(extracted_offers)
+        self.names_key = _names_key(self.names)
+        self.normalized_names = _normalize_names_for_fuzzy(self.names) # Lexical pre-filter input, None without RapidFuzz
+        self.embeddings = None # Computed on first local match, if sentence-transformers is installed
+        self._client = None
+
+    def _ensure_client(self) -> genai.Client:
+        """Returns the (shared) Gemini client; raises ValueError on API key configuration errors."""
+        if self._client is None:
+            self._client = _get_client(self.api_key)
+        return self._client
+
+    def _resolve_without_ai(self, user_items: list[str]) -> tuple[dict, list[str]]:
+        """
+        Answers duplicate and previously seen items from the cache, then clear matches lexically
+        and locally. Returns the results so far and the items that still need Gemini.
+        Blocking (disk cache, RapidFuzz, sentence-transformers), so it runs in a worker thread,
+        not on the event loop that all Gemini requests share.
+        """
+        results, pending_items = _lookup_cached_matches(user_items, self.names_key, self.offers_by_name)
+        pending_items = _resolve_fuzzy(pending_items, self.normalized_names, self.names_key, self.extracted_offers, results)
+        if LOCAL_MATCHING and pending_items:
+            if self.embeddings is None:
+                self.embeddings = _get_brochure_embeddings(self.names, self.names_key)
+            local_matches, pending_items, match_scores = _match_local(pending_items, self.embeddings, self.extracted_offers, LOCAL_MATCH_THRESHOLD)
+            for user_item, offer in local_matches.items():
+                # Uncertain local matches are kept in memory only, like lexical ones
+                persist = _is_confident_local_match(user_item, offer, match_scores[user_item])
+                _cache_match(user_item, self.names_key, offer, persist=persist)
+                results[user_item] = offer
+        return results, pending_items
+
+    def match(self, user_item: str) -> dict | None:
+        """Matches a single item; see match_many_async for the possible results."""
+        return self.match_many([user_item])[0]
+
+    def match_many(self, user_items: list[str]) -> list[dict | None]:
+        """Synchronous wrapper around match_many_async."""
+        return _run(self.match_many_async(user_items))
+
+    async def match_many_async(self, user_items: list[str]) -> list[dict | None]:
+        """
+        Matches several user grocery items concurrently, issuing one Gemini request per item
+        that could not be resolved without it, and awaiting them together.
+
+        Returns:
+            A list aligned with user_items. Each entry is the matched offer dictionary, None if there
+            was no match, or an error dictionary ({"status": "error", ...}) if the call failed.
+        """
+        if not self.extracted_offers:
+            return [None] * len(user_items) # No offers to match against
+
+        item_keys, representatives = _unique_items(user_items)
+        # Off the shared event loop: cache reads, fuzzy scoring and embedding model loads block
+        results, pending_items = await asyncio.to_thread(self._resolve_without_ai, list(representatives.values()))
+        if pending_items:
+            try:
+                client = self._ensure_client()
+            except ValueError as ve: # Handles API key configuration errors
+                error = {"status": "error", "message": f"API Key configuration error during matching: {str(ve)}"}
+                return [results.get(representatives[item_key], error) for item_key in item_keys]
+
+            await self._match_each(client, pending_items, results)
+
+        return [results[representatives[item_key]] for item_key in item_keys]
+
+    async def _match_each(self, client: genai.Client, user_items: list[str], results: dict) -> None:
+        """Matches user_items with one concurrent Gemini request per item and stores them in results."""
+        item_results = await asyncio.gather(
+            *[_match_one(client, user_item, self.names_json, self.offers_by_name) for user_item in user_items],
+            return_exceptions=True
+        )
+        matched = {}
+        for user_item, result in zip(user_items, item_results):
+            if isinstance(result, BaseException):
+                result = {"status": "error", "message": f"Error matching item '{user_item}': {str(result)}"}
+            else:
+                matched[user_item] = result
+            results[user_item] = result
+        await asyncio.to_thread(self._cache_matches, matched)
+
+    def _cache_matches(self, matched: dict[str, dict | None]) -> None:
+        """Caches Gemini's answers; blocking (disk cache), so it runs in a worker thread."""
+        for user_item, result in matched.items():
+            _cache_match(user_item, self.names_key, result)
+
+    def match_bulk(self, user_items: list[str]) -> dict[str, dict | None]:
+        """Synchronous wrapper around match_bulk_async."""
+        return _run(self.match_bulk_async(user_items))
+
+    async def match_bulk_async(self, user_items: list[str]) -> dict[str, dict | None]:
+        """
+        Matches all user grocery items with a single prompt per MATCH_BATCH_SIZE items that could
+        not be resolved without Gemini, instead of one request per item.
+
+        Returns:
+            A dictionary mapping each user item to its matched offer dictionary, None if there was
+            no match, or an error dictionary ({"status": "error", ...}) if matching failed.
+        """
+        if not self.extracted_offers:
+            return {user_item: None for user_item in user_items} # No offers to match against
+
+        item_keys, representatives = _unique_items(user_items)
+        # Off the shared event loop: cache reads, fuzzy scoring and embedding model loads block
+        results, pending_items = await asyncio.to_thread(self._resolve_without_ai, list(representatives.values()))
+        if not pending_items:
+            return {user_item: results[representatives[item_key]] for item_key, user_item in zip(item_keys, user_items)}
+
+        try:
+            client = self._ensure_client()
+        except ValueError as ve: # Handles API key configuration errors
+            error = {"status": "error", "message": f"API Key configuration error during matching: {str(ve)}"}
+            return {user_item: results.get(representatives[item_key], error) for item_key, user_item in zip(item_keys, user_items)}
+
+        chunks = [pending_items[i:i + MATCH_BATCH_SIZE] for i in range(0, len(pending_items), MATCH_BATCH_SIZE)]
+        chunk_results = await asyncio.gather(
+            *[_match_chunk(client, chunk, self.names_json, self.offers_by_name) for chunk in chunks]
+        )
+
+        unbatched_items = []
+        matched = {}
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            for user_item in chunk:
+                if user_item not in chunk_result:
+                    unbatched_items.append(user_item)
+                    continue
+                matched[user_item] = chunk_result[user_item]
+        results.update(matched)
+        await asyncio.to_thread(self._cache_matches, matched)
+        if unbatched_items:
+            # The bulk answer was unusable for these items, so fall back to concurrent per-item requests
+            await self._match_each(client, unbatched_items, results)
+        return {user_item: results[representatives[item_key]] for item_key, user_item in zip(item_keys, user_items)}
+
+# --- End of Matcher ---
+
+
+def prepare_offer_context(api_key: str, extracted_offers: list[dict]) -> Matcher:
+    """
+    Serializes the brochure's product names for the matching prompt (and builds the name -> offer
+    lookup) once, returning a handle to pass to match_item_to_brochure_offers in place of the offer
+    list, so matching item after item does not re-serialize the offers on every call.
+    """
+    return Matcher(extracted_offers, api_key)
+
+
+def match_item_to_brochure_offers(api_key: str, user_item: str, extracted_offers: list[dict] | Matcher) -> dict | None:
     """
     Matches a single user grocery item against a list of extracted brochure offers using semantic search with Gemini.
+    Kept for existing callers; build a Matcher to reuse the brochure state across several items.
 
     Args:
         api_key: The Google Gemini API key.
         user_item: The grocery item string from the user's list (e.g., "Tomaten").
         extracted_offers: A list of offer dictionaries (previously extracted by get_ai_analysis).
                           Example: [{"product_name": "Bio Rispentomaten", "price": "2.49", ...}, ...]
+                          Or the handle returned by prepare_offer_context, when matching many items
+                          one by one against the same offers.
 
     Returns:
         The full dictionary of the best matched offer from extracted_offers if a good match is found.
         Returns None if no satisfactory match is found or an error occurs.
     """
-    if not extracted_offers:
-        return None # No offers to match against
+    if isinstance(extracted_offers, Matcher):
+        return extracted_offers.match(user_item)
+    return Matcher(extracted_offers, api_key).match(user_item)
 
-    try:
-        genai.configure(api_key=api_key) # Ensure API key is configured for this call too
-        model = genai.GenerativeModel('gemini-pro')
 
-        # Create a simplified list of product names from the brochure for the prompt
-        brochure_product_names = [offer.get("product_name", "Unknown Product") for offer in extracted_offers]
-        
+def match_items_to_brochure_offers(api_key: str, user_items: list[str], extracted_offers: list[dict]) -> dict[str, dict | None]:
+    """
+    Matches a whole grocery list against the brochure offers in one go: the product names are sent
+    once with all items that need the AI (one request per MATCH_BATCH_SIZE items) instead of one
+    request per item.
+
+    Args:
+        api_key: The Google Gemini API key.
+        user_items: The grocery item strings from the user's list.
+        extracted_offers: A list of offer dictionaries (previously extracted by get_ai_analysis).
+
+    Returns:
+        A dictionary mapping each user item to its matched offer dictionary (an element of
+        extracted_offers), None if there was no match, or an error dictionary ({"status": "error", ...}).
+    """
+    return Matcher(extracted_offers, api_key).match_bulk(user_items)
+
+
+async def match_items_batch(api_key: str, user_items: list[str], extracted_offers: list[dict]) -> list[dict | None]:
+    """
+    Matches several user grocery items concurrently; shorthand for
+    Matcher(extracted_offers, api_key).match_many_async(user_items).
+    """
+    return await Matcher(extracted_offers, api_key).match_many_async(user_items)
+
+
+def _lookup_cached_matches(user_items: list[str], names_key: str, offers_by_name: dict[str, dict]) -> tuple[dict, list[str]]:
+    """
+    Splits user items into cached results and the (deduplicated) items that still need the AI.
+    """
+    results = {}
+    pending_items = []
+    for user_item in dict.fromkeys(user_items):
+        cached_name = _cache_get(_match_key(user_item, names_key))
+        if cached_name is None:
+            pending_items.append(user_item)
+        elif cached_name == _NO_MATCH:
+            results[user_item] = None
+        else:
+            offer = offers_by_name.get(cached_name)
+            if offer is None:
+                pending_items.append(user_item)
+            else:
+                results[user_item] = offer
+    return results, pending_items
+
+
+def _resolve_matched_name(matched_product_name: str | None, offers_by_name: dict[str, dict]) -> dict | None:
+    """
+    Maps the product name chosen by the AI to its full offer dictionary with a single dict lookup.
+    Returns None for no match and an error dictionary for a name that is not in the offer list.
+    """
+    if not matched_product_name or matched_product_name == "NO_MATCH_FOUND":
+        return None
+    # A name outside the list should not happen if the AI follows the prompt, but as a fallback:
+    return offers_by_name.get(
+        matched_product_name,
+        {"status": "error", "message": "AI matched a name not in the provided offer list.", "matched_name": matched_product_name},
+    )
+
+
+async def _match_one(client: genai.Client, user_item: str, names_json: str, offers_by_name: dict[str, dict]) -> dict | None:
+    """
+    Asks Gemini for the best brochure product name for a single user item and resolves it to its offer.
+    """
+    try:
         prompt = f"""
         You are a semantic matching assistant. Your task is to find the best match for a user's grocery item
         from a list of product names extracted from a grocery brochure.
@@ -128,50 +994,43 @@ def match_item_to_brochure_offers(api_key: str, user_item: str, extracted_offers
         User's grocery item: "{user_item}"
 
         List of product names from the brochure:
-        {json.dumps(brochure_product_names, ensure_ascii=False)}
+        {names_json}
 
         Instructions:
         1. Analyze the user's grocery item.
         2. Compare it semantically against each product name in the provided list from the brochure.
         3. Identify the single best match from the brochure list. The match should be a close semantic equivalent. For example, "Tomaten" should match "Bio Rispentomaten". "Milch" should match "Frische Vollmilch 3.5%".
-        4. If a good semantic match is found, respond with ONLY the exact product name from the brochure list that is the best match. For example, if "Bio Rispentomaten" is the best match for "Tomaten", respond with "Bio Rispentomaten".
+        4. If a good semantic match is found, set "match" to the exact product name from the brochure list that is the best match. For example, if "Bio Rispentomaten" is the best match for "Tomaten", set "match" to "Bio Rispentomaten".
         5. If multiple items could match, pick the most general or common one, or the one that seems like the best deal if price information were available (though it is not provided in this step, so focus on name similarity).
-        6. If no product name from the brochure list is a good semantic match for the user's item, respond with the exact string "NO_MATCH_FOUND".
-
-        Do not include any explanations or other text in your response. Only the matched product name or "NO_MATCH_FOUND".
+        6. If no product name from the brochure list is a good semantic match for the user's item, set "match" to the exact string "NO_MATCH_FOUND".
 
         Example Response for a match:
-        Bio Rispentomaten
+        {{"match": "Bio Rispentomaten"}}
 
         Example Response for no match:
-        NO_MATCH_FOUND
+        {{"match": "NO_MATCH_FOUND"}}
         """
 
-        response = model.generate_content(prompt)
+        response = await client.aio.models.generate_content(model=MODEL_NAME, contents=prompt, config=_MATCH_CONFIG)
         
-        matched_product_name = None
+        response_text = None
         if hasattr(response, 'text') and response.text:
-            matched_product_name = response.text.strip()
+            response_text = response.text
         elif response.parts:
-            matched_product_name = "".join(part.text for part in response.parts if hasattr(part, 'text')).strip()
-
-        if matched_product_name and matched_product_name != "NO_MATCH_FOUND":
-            # Find the full offer dictionary corresponding to the matched product name
-            for offer in extracted_offers:
-                if offer.get("product_name") == matched_product_name:
-                    return offer # Return the full offer dictionary
-            # This case should ideally not happen if AI returns a name from the list, but as a fallback:
-            return {"status": "error", "message": "AI matched a name not in the provided offer list.", "matched_name": matched_product_name}
-        elif matched_product_name == "NO_MATCH_FOUND":
-            return None # Explicit no match
-        else:
-            # Handle cases where AI response is unexpected (e.g., empty or malformed)
-            # print(f"Unexpected AI response for item '{user_item}': '{matched_product_name}'") # For server logging
-            return None 
+            response_text = "".join(part.text for part in response.parts if hasattr(part, 'text'))
+
+        matched_product_name = None
+        if response_text:
+            try:
+                match_answer = _decode_json_payload(response_text, '{')
+            except json.JSONDecodeError:
+                match_answer = None
+            if isinstance(match_answer, dict) and isinstance(match_answer.get("match"), str):
+                matched_product_name = match_answer["match"].strip()
+
+        # Empty or malformed answers are treated like an explicit NO_MATCH_FOUND
+        return _resolve_matched_name(matched_product_name, offers_by_name)
 
-    except ValueError as ve: # Handles API key configuration errors
-        # print(f"API Key error during matching for '{user_item}': {str(ve)}") # Server logging
-        return {"status": "error", "message": f"API Key configuration error during matching: {str(ve)}"} # Indicate error
     except Exception as e:
         # print(f"Error matching item '{user_item}': {str(e)}") # Server logging
         error_message = f"Error matching item '{user_item}': {str(e)}"
@@ -180,6 +1039,82 @@ def match_item_to_brochure_offers(api_key: str, user_item: str, extracted_offers
         return {"status": "error", "message": error_message}
 
 
+def match_items_bulk(api_key: str, user_items: list[str], extracted_offers: list[dict]) -> dict[str, dict | None]:
+    """
+    Synchronous wrapper around match_items_bulk_async.
+    """
+    return _run(match_items_bulk_async(api_key, user_items, extracted_offers))
+
+
+async def match_items_bulk_async(api_key: str, user_items: list[str], extracted_offers: list[dict]) -> dict[str, dict | None]:
+    """
+    Matches all user grocery items with one prompt per MATCH_BATCH_SIZE items; shorthand for
+    Matcher(extracted_offers, api_key).match_bulk_async(user_items).
+    """
+    return await Matcher(extracted_offers, api_key).match_bulk_async(user_items)
+
+
+async def _match_chunk(client: genai.Client, user_items: list[str], names_json: str, offers_by_name: dict[str, dict]) -> dict[str, dict | None]:
+    """
+    Sends one row-marshalled matching prompt for a chunk of user items and resolves the answers to offers.
+    Items the response does not answer (all of them if it is not a JSON object) are left out of the
+    result so the caller can match them individually; service errors are returned for every item.
+    """
+    try:
+        prompt = f"""
+        You are a semantic matching assistant. Your task is to find the best match for each of a user's grocery items
+        from a list of product names extracted from a grocery brochure.
+
+        User's grocery items:
+        {_dumps(user_items)}
+
+        List of product names from the brochure:
+        {names_json}
+
+        Instructions:
+        1. For each user item, compare it semantically against each product name in the brochure list.
+        2. Identify the single best match from the brochure list. The match should be a close semantic equivalent. For example, "Tomaten" should match "Bio Rispentomaten". "Milch" should match "Frische Vollmilch 3.5%".
+        3. Use ONLY exact product names from the brochure list as values.
+        4. If no product name from the brochure list is a good semantic match for a user item, use the exact string "NO_MATCH_FOUND".
+
+        Return a single JSON object with one key per user item (exactly as given above) and the matched
+        product name or "NO_MATCH_FOUND" as its value. Do NOT include any text outside of the JSON object.
+
+        Example:
+        {{"Tomaten": "Bio Rispentomaten", "Käse": "NO_MATCH_FOUND"}}
+        """
+
+        response = await client.aio.models.generate_content(model=MODEL_NAME, contents=prompt, config=_BULK_MATCH_CONFIG)
+
+        response_text = None
+        if hasattr(response, 'text') and response.text:
+            response_text = response.text.strip()
+        elif response.parts:
+            response_text = "".join(part.text for part in response.parts if hasattr(part, 'text')).strip()
+
+        try:
+            matched_names = _decode_json_payload(response_text, '{') if response_text else None
+        except json.JSONDecodeError:
+            matched_names = None
+        if not isinstance(matched_names, dict):
+            return {}
+
+        results = {}
+        for user_item in user_items:
+            if user_item not in matched_names:
+                continue
+            matched_product_name = matched_names[user_item]
+            results[user_item] = _resolve_matched_name(matched_product_name if isinstance(matched_product_name, str) else None, offers_by_name)
+        return results
+
+    except Exception as e:
+        error_message = f"Error matching items in bulk: {str(e)}"
+        if hasattr(e, 'message'):
+             error_message = f"AI service error (bulk matching): {e.message}"
+        error = {"status": "error", "message": error_message}
+        return {user_item: error for user_item in user_items}
+
+
 if __name__ == '__main__':
     print("Running direct tests of ai_client.py...")
     test_api_key = os.environ.get("GOOGLE_API_KEY")
@@ -220,14 +1155,8 @@ if __name__ == '__main__':
         print(f"Status: {analysis_result.get('status')}")
         
         if analysis_result.get("status") == "success":
-            print("AI Response (should be JSON string):")
-            # Try to pretty-print if it's valid JSON
-            try:
-                parsed_json = json.loads(analysis_result["ai_response"])
-                print(json.dumps(parsed_json, indent=2, ensure_ascii=False))
-            except json.JSONDecodeError:
-                print("Response was not valid JSON, printing raw:")
-                print(analysis_result["ai_response"])
+            print("Extracted Offers:")
+            print(json.dumps(analysis_result["offers"], indent=2, ensure_ascii=False))
         elif analysis_result.get("status") == "error":
             print(f"Error Message: {analysis_result.get('message')}")
             if "ai_raw_response" in analysis_result:
@@ -238,4 +1167,3 @@ if __name__ == '__main__':
         print("\n--- End of Test ---")
         print("Note: The grocery_list argument is currently ignored by the prompt in get_ai_analysis.")
         print("The focus is on extracting all deals from the brochure content into a structured JSON format.")
-```
@@ -1,27 +1,89 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template
+from werkzeug.utils import secure_filename
 import os
-import json # For parsing AI response
+import sys
 import re # For regex operations in unit standardization
-from ai_client import get_ai_analysis, match_item_to_brochure_offers # Import AI client functions
+import functools
+import math
+from pathlib import Path
+from ai_client import get_ai_analysis, match_items_to_brochure_offers # Import AI client functions
 from pdf_processor import extract_text_from_pdf # Import PDF processing function
 
+try:
+    import orjson # Optional: faster serialization of the (large) offer list responses
+except ImportError:
+    orjson = None
+
 app = Flask(__name__)
 UPLOAD_FOLDER = 'uploads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['ARCHIVE_UPLOADS'] = os.environ.get("ARCHIVE_UPLOADS", "").lower() in ("1", "true", "yes") # Keep a copy of each uploaded brochure
 
-# Ensure the upload folder exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Ensure the upload folder exists (once, at startup)
+Path(UPLOAD_FOLDER).mkdir(parents=True, exist_ok=True)
 
 # --- Helper Functions for Unit Standardization ---
 
+# Unit names shared by every standardized offer: interned once, so the unit comparisons below and the
+# 'comparable_unit' values of all offers use the same string objects
+_KG = sys.intern("kg")
+_L = sys.intern("L")
+_STK = sys.intern("Stück")
+_PKG = sys.intern("Packung")
+_FL = sys.intern("Flasche")
+_BUND = sys.intern("Bund")
+
+# Patterns are compiled once at import instead of being looked up in re's cache on every offer
+class _PriceCharTable(dict):
+    """str.translate table that keeps digits, separators and spaces and deletes every other character."""
+    def __missing__(self, key):
+        return None
+
+_PRICE_CHARS = _PriceCharTable({ord(char): char for char in "0123456789,. "})
+# All quantity formats in one alternation, so a single scan finds every candidate; the named
+# group that closes each match (lastgroup) tells which format it is.
+_RE_QUANTITY_ANY = re.compile(
+    r"(?P<mp_n>\d+)\s*x\s*(?P<mp_q>\d+(?:[,\.]\d+)?)\s*(?P<mp_u>kg|g|l|liter|ml|stk|stück|st)" # "2 x 1.5L", "3x70g"
+    r"|(?P<q>\d+(?:[,\.]\d+)?)\s*(?P<u>kg|g|l|liter|ml|stk|stück|st)" # "500g", "1.5L", "1kg"
+    r"|(?P<pack_n>\d+)\s*er\s*(?:pack|pkg|tray|kiste|beutel|netz|schale)" # "6er Pack", "10er Tray"
+    r"|(?P<stueck>stück|stk|st)|(?P<packung>packung|pkg)|(?P<flasche>flasche)|(?P<bund>bund)" # Bare units, assume 1
+)
+# Format precedence when several occur in one text (lower wins), keyed by each format's last group
+_QUANTITY_PRIORITY = {"mp_u": 0, "u": 1, "pack_n": 2, "stueck": 3, "packung": 4, "flasche": 5, "bund": 6}
+_BARE_UNITS = {"stueck": _STK, "packung": _PKG, "flasche": _FL, "bund": _BUND}
+_RE_COND_PRICE = re.compile(r"(\d+)\s*(?:stück|stk|packungen|pkg)?\s*(?:für|zum preis von|nur)\s*(\d+([,\.]\d+)?)") # "2 für 1.80€"
+
+# "Price per ..." markers for offers without a parsable quantity, in the condition and in the unit text
+_RE_PRICE_BASIS_CONDITION = re.compile(r"(?P<per_100g>(?:pro|je) 100\s*g)|(?P<per_kg>(?:pro|je) kg)|(?P<per_l>(?:pro|je) l(?:iter)?\b)")
+_RE_PRICE_BASIS_UNIT = re.compile(r"(?P<per_100g>100\s*g\s*=)|(?P<per_kg>/kg)|(?P<per_l>/l(?:iter)?\b)")
+
+# Spellings folded together by extract_quantity_and_unit_from_string, so _UNIT_CONVERSIONS stays small
+_UNIT_SYNONYMS = {"liter": "l", "stück": _STK, "stk": _STK, "st": _STK}
+
+# parsed unit -> (factor applied to price per parsed unit, comparable unit, notes template)
+_UNIT_CONVERSIONS = {
+    "g": (1000.0, _KG, "Converted to price per kg from {quantity}g."),
+    "ml": (1000.0, _L, "Converted to price per L from {quantity}ml."),
+    _KG: (1.0, _KG, "Price per kg (original {quantity}kg)."),
+    "l": (1.0, _L, "Price per L (original {quantity}L)."),
+    _STK: (1.0, _STK, "Price per Stück (original {quantity} Stück)."),
+    _PKG: (1.0, _PKG, "Price per Packung (original {quantity} Packung)."),
+    _FL: (1.0, _FL, "Price per Flasche (original {quantity} Flasche)."),
+    _BUND: (1.0, _BUND, "Price per Bund (original {quantity} Bund)."),
+}
+
 def parse_price(price_str: str) -> float | None:
+    if isinstance(price_str, (int, float)) and not isinstance(price_str, bool):
+        return float(price_str) # Already numeric (e.g. from a streamed JSON response)
     if not price_str or not isinstance(price_str, str):
         return None
     try:
-        # Replace comma with dot for European formats, remove other non-numeric (except dot)
-        cleaned_price = price_str.replace('.', '').replace(',', '.') 
-        # Remove currency symbols or other text if any left (e.g. "€ 2.99", "ca. 1.99")
-        cleaned_price = re.sub(r"[^0-9\.]", "", cleaned_price)
+        # Keep only digits, separators and spaces in one C-level pass, then drop the separator-only
+        # leftovers of words such as "ca." ("€ 3.50" -> "3.50", "ca. 1,29" -> "1,29")
+        cleaned_price = "".join(token for token in price_str.translate(_PRICE_CHARS).split() if token.strip(".,"))
+        if ',' in cleaned_price:
+            # European format ("1.234,56", "0,95"): dots group thousands, the comma is the decimal mark
+            cleaned_price = cleaned_price.replace('.', '').replace(',', '.')
         if not cleaned_price: return None
         return float(cleaned_price)
     except ValueError:
@@ -36,73 +98,83 @@ def extract_quantity_and_unit_from_string(text: str) -> tuple[float | None, str
              "6er Pack" -> (1, "Stück", 6)
              "1 Stk" -> (1, "Stück", 1)
     """
-    if not text: text = ""
-    text = text.lower()
-
-    # For "2 x 1.5L" type formats or "3x70g"
-    multipack_match = re.search(r"(\d+)\s*x\s*(\d+(?:[,\.]\d+)?)\s*(kg|g|l|liter|ml|stk|stück|st)", text)
-    if multipack_match:
-        item_count = int(multipack_match.group(1))
-        quantity = parse_price(multipack_match.group(2)) # Use parse_price for "1,5" etc.
-        unit = multipack_match.group(3)
-        if unit == "liter": unit = "l"
-        if unit == "stück" or unit == "stk": unit = "Stück"
-        return quantity, unit, item_count
-
-    # For "500g", "1.5L", "1kg"
-    quantity_match = re.search(r"(\d+(?:[,\.]\d+)?)\s*(kg|g|l|liter|ml|stk|stück|st)", text)
-    if quantity_match:
-        quantity = parse_price(quantity_match.group(1))
-        unit = quantity_match.group(2)
-        if unit == "liter": unit = "l"
-        if unit == "stück" or unit == "stk": unit = "Stück"
-        return quantity, unit, 1 # Default item count is 1
-
-    # For "6er Pack", "10er Tray" (number of items in a pack)
-    item_count_match = re.search(r"(\d+)\s*(er)\s*(pack|pkg|tray|kiste|beutel|netz|schale)", text)
-    if item_count_match:
-        return 1, "Stück", int(item_count_match.group(1)) # Quantity 1 of "Stück", but item_count is N
-
-    # For "Stück", "Packung" without explicit numbers (assume 1)
-    if "stück" in text or "stk" in text or "st" in text: return 1, "Stück", 1
-    if "packung" in text or "pkg" in text: return 1, "Packung", 1
-    if "flasche" in text: return 1, "Flasche", 1
-    if "bund" in text : return 1, "Bund", 1
-    
-    return None, None, 1 # Default item count is 1 if not a multipack
+    return _extract_quantity_and_unit(text.lower() if text else "")
+
+def _extract_quantity_and_unit(text: str) -> tuple[float | None, str | None, int | None]:
+    """extract_quantity_and_unit_from_string for text that is already lowercase."""
+    # Pick the highest-precedence format found in one pass; a multipack cannot be beaten, so stop there
+    best_match = None
+    for match in _RE_QUANTITY_ANY.finditer(text):
+        if best_match is None or _QUANTITY_PRIORITY[match.lastgroup] < _QUANTITY_PRIORITY[best_match.lastgroup]:
+            best_match = match
+            if match.lastgroup == "mp_u":
+                break
+    if best_match is None:
+        return None, None, 1 # Default item count is 1 if not a multipack
+
+    kind = best_match.lastgroup
+    if kind == "mp_u": # For "2 x 1.5L" type formats or "3x70g"
+        unit = best_match.group("mp_u")
+        return parse_price(best_match.group("mp_q")), _UNIT_SYNONYMS.get(unit, unit), int(best_match.group("mp_n")) # Use parse_price for "1,5" etc.
+    if kind == "u": # For "500g", "1.5L", "1kg"
+        unit = best_match.group("u")
+        return parse_price(best_match.group("q")), _UNIT_SYNONYMS.get(unit, unit), 1 # Default item count is 1
+    if kind == "pack_n": # For "6er Pack", "10er Tray" (number of items in a pack)
+        return 1, _STK, int(best_match.group("pack_n")) # Quantity 1 of "Stück", but item_count is N
+    return 1, _BARE_UNITS[kind], 1 # For "Stück", "Packung" without explicit numbers (assume 1)
 
 def standardize_offer_price(offer: dict) -> dict:
     """
     Calculates standardized unit price for an offer.
     Adds: 'calculated_price_float', 'comparable_unit', 'standardized_unit_price', 'standardization_notes'
     """
-    product_name = offer.get("product_name", "")
-    price_str = offer.get("price", "")
-    unit_str = offer.get("unit", "") # e.g. "kg", "500g Packung", "Liter"
-    condition_str = offer.get("offer_condition", "")  # e.g. "2 für 1.80€", "pro 100g"
+    offer_key = (
+        offer.get("product_name", ""),
+        offer.get("price", ""),
+        offer.get("unit", ""), # e.g. "kg", "500g Packung", "Liter"
+        offer.get("offer_condition") or "", # e.g. "2 für 1.80€", "pro 100g"; the AI may return null
+    )
+    try:
+        standardized = _standardize_core(*offer_key)
+    except TypeError: # Unhashable field values (e.g. a list) cannot be memoized
+        standardized = _standardize_core.__wrapped__(*offer_key)
+    offer.update(standardized)
+    return offer
 
+@functools.lru_cache(maxsize=4096)
+def _standardize_core(product_name: str, price_str: str, unit_str: str, condition_str: str) -> dict:
+    """
+    Pure standardization kernel behind standardize_offer_price, memoized on the offer's fields so
+    repeated offers (the same product on several pages, matched offers, re-processed brochures) are
+    only parsed once. Returns the four added fields; callers must not mutate the returned dict.
+    """
+    standardized = {}
     calculated_price = parse_price(price_str)
-    offer['calculated_price_float'] = calculated_price
-    offer['comparable_unit'] = unit_str # Default
-    offer['standardized_unit_price'] = calculated_price # Default
-    offer['standardization_notes'] = "Original price used."
+    standardized['calculated_price_float'] = calculated_price
+    standardized['comparable_unit'] = unit_str # Default
+    standardized['standardized_unit_price'] = calculated_price # Default
+    standardized['standardization_notes'] = "Original price used."
 
     if calculated_price is None:
-        offer['standardization_notes'] = "Could not parse price."
-        return offer
+        standardized['standardization_notes'] = "Could not parse price."
+        return standardized
 
+    # Lowercase each field once; every check below works on these
+    product_lower = f"{product_name}".lower()
+    unit_lower = f"{unit_str}".lower()
+    condition_lower = f"{condition_str}".lower()
     # Combine all text sources for quantity extraction
-    search_text_for_quantity = f"{product_name} {unit_str} {condition_str}".lower()
+    search_text_for_quantity = f"{product_lower} {unit_lower} {condition_lower}"
     
     # 1. Check for "X für Y€" in conditions first
-    condition_price_match = re.search(r"(\d+)\s*(?:stück|stk|packungen|pkg)?\s*(?:für|zum preis von|nur)\s*(\d+([,\.]\d+)?)", condition_str.lower())
+    condition_price_match = _RE_COND_PRICE.search(condition_lower)
     if condition_price_match:
         num_items_in_condition = int(condition_price_match.group(1))
         total_price_in_condition = parse_price(condition_price_match.group(2))
         if num_items_in_condition > 0 and total_price_in_condition is not None:
             calculated_price = total_price_in_condition / num_items_in_condition
-            offer['calculated_price_float'] = calculated_price # This is now price per item in the deal
-            offer['standardization_notes'] = f"Original: {num_items_in_condition} for {total_price_in_condition}€. Effective price per item: {calculated_price:.2f}€."
+            standardized['calculated_price_float'] = calculated_price # This is now price per item in the deal
+            standardized['standardization_notes'] = f"Original: {num_items_in_condition} for {total_price_in_condition}€. Effective price per item: {calculated_price:.2f}€."
             # Now, try to standardize this new item price further if its unit is known (e.g. each item is 500g)
             # Fallthrough to next logic with the new calculated_price for one item.
             # The unit_str still describes one item.
@@ -111,7 +183,7 @@ def standardize_offer_price(offer: dict) -> dict:
     # The `unit_str` from AI might be "kg", "Liter", but also "500g Packung", "1.5L Flasche"
     # The `product_name` might also contain "6er Pack" etc.
     
-    quantity, parsed_unit, items_in_pack = extract_quantity_and_unit_from_string(search_text_for_quantity)
+    quantity, parsed_unit, items_in_pack = _extract_quantity_and_unit(search_text_for_quantity)
     
     original_unit_info = f"Unit: '{unit_str}', Product: '{product_name}', Cond: '{condition_str}'"
     notes_suffix = ""
@@ -119,64 +191,60 @@ def standardize_offer_price(offer: dict) -> dict:
     if parsed_unit and quantity is not None:
         current_price_for_quantity = calculated_price # This is price for 'quantity' of 'parsed_unit' * 'items_in_pack'
         
-        if items_in_pack > 1 and parsed_unit == "Stück": # e.g. 6er pack, price is for 6 items
+        if items_in_pack > 1 and parsed_unit == _STK: # e.g. 6er pack, price is for 6 items
             current_price_for_quantity = current_price_for_quantity / items_in_pack
             notes_suffix += f" Priced per item from {items_in_pack}-pack."
             # quantity is already 1 for "Stück", so this is price per single piece.
         
-        if parsed_unit == "g" or parsed_unit == "gramm":
-            if quantity > 0:
-                offer['standardized_unit_price'] = (current_price_for_quantity / quantity) * 1000
-                offer['comparable_unit'] = "kg"
-                offer['standardization_notes'] = f"Converted to price per kg from {quantity}g.{notes_suffix} {original_unit_info}"
-        elif parsed_unit == "ml":
-            if quantity > 0:
-                offer['standardized_unit_price'] = (current_price_for_quantity / quantity) * 1000
-                offer['comparable_unit'] = "L"
-                offer['standardization_notes'] = f"Converted to price per L from {quantity}ml.{notes_suffix} {original_unit_info}"
-        elif parsed_unit == "kg":
-            if quantity > 0: # e.g. "0.5 kg"
-                offer['standardized_unit_price'] = current_price_for_quantity / quantity
-                offer['comparable_unit'] = "kg"
-                offer['standardization_notes'] = f"Price per kg (original {quantity}kg).{notes_suffix} {original_unit_info}"
-        elif parsed_unit == "l" or parsed_unit == "liter":
-             if quantity > 0: # e.g. "0.75 L"
-                offer['standardized_unit_price'] = current_price_for_quantity / quantity
-                offer['comparable_unit'] = "L"
-                offer['standardization_notes'] = f"Price per L (original {quantity}L).{notes_suffix} {original_unit_info}"
-        elif parsed_unit == "Stück" or parsed_unit == "Packung" or parsed_unit == "Flasche" or parsed_unit == "Bund":
-            if quantity > 0: # quantity is usually 1 here unless "2 Stück" was parsed
-                offer['standardized_unit_price'] = current_price_for_quantity / quantity 
-                offer['comparable_unit'] = parsed_unit # "Stück" or "Packung" etc.
-                offer['standardization_notes'] = f"Price per {parsed_unit} (original {quantity} {parsed_unit}).{notes_suffix} {original_unit_info}"
+        conversion = _UNIT_CONVERSIONS.get(parsed_unit)
+        if conversion:
+            if quantity > 0: # e.g. "500g", "0.75 L"; usually 1 for "Stück" unless "2 Stück" was parsed
+                factor, comparable_unit, notes_template = conversion
+                standardized['standardized_unit_price'] = (current_price_for_quantity / quantity) * factor
+                standardized['comparable_unit'] = comparable_unit
+                standardized['standardization_notes'] = f"{notes_template.format(quantity=quantity)}{notes_suffix} {original_unit_info}"
         else: # Unknown parsed unit, or quantity was None
-            if not offer['standardization_notes'] or offer['standardization_notes'] == "Original price used.":
-                 offer['standardization_notes'] = f"Could not fully standardize. {original_unit_info}"
-
-    elif "pro 100g" in condition_str.lower() or "je 100g" in condition_str.lower() or "100g =" in unit_str.lower():
-        # Price is given per 100g
-        offer['standardized_unit_price'] = calculated_price * 10 # Price per 1kg
-        offer['comparable_unit'] = "kg"
-        offer['standardization_notes'] = f"Converted to price per kg from 100g price. {original_unit_info}"
-    elif "pro kg" in condition_str.lower() or "je kg" in condition_str.lower() or "/kg" in unit_str.lower():
-        offer['standardized_unit_price'] = calculated_price
-        offer['comparable_unit'] = "kg"
-        offer['standardization_notes'] = f"Price is per kg. {original_unit_info}"
-    # Add more rules as needed, e.g. for "pro Liter"
+            if not standardized['standardization_notes'] or standardized['standardization_notes'] == "Original price used.":
+                 standardized['standardization_notes'] = f"Could not fully standardize. {original_unit_info}"
+
+    else:
+        # One scan of each field finds every "price per ..." marker; 100g wins over kg over L
+        price_bases = {match.lastgroup for match in _RE_PRICE_BASIS_CONDITION.finditer(condition_lower)}
+        price_bases.update(match.lastgroup for match in _RE_PRICE_BASIS_UNIT.finditer(unit_lower))
+        if "per_100g" in price_bases:
+            # Price is given per 100g
+            standardized['standardized_unit_price'] = calculated_price * 10 # Price per 1kg
+            standardized['comparable_unit'] = _KG
+            standardized['standardization_notes'] = f"Converted to price per kg from 100g price. {original_unit_info}"
+        elif "per_kg" in price_bases:
+            standardized['standardized_unit_price'] = calculated_price
+            standardized['comparable_unit'] = _KG
+            standardized['standardization_notes'] = f"Price is per kg. {original_unit_info}"
+        elif "per_l" in price_bases:
+            standardized['standardized_unit_price'] = calculated_price
+            standardized['comparable_unit'] = _L
+            standardized['standardization_notes'] = f"Price is per L. {original_unit_info}"
+        # Add more rules as needed
 
     # Ensure standardized price is rounded
-    if offer.get('standardized_unit_price') is not None:
+    if standardized.get('standardized_unit_price') is not None:
         try:
-            offer['standardized_unit_price'] = round(float(offer['standardized_unit_price']), 2)
+            standardized['standardized_unit_price'] = round(float(standardized['standardized_unit_price']), 2)
         except (ValueError, TypeError):
             # If it somehow became non-numeric, revert to calculated_price_float
-            offer['standardized_unit_price'] = offer['calculated_price_float']
+            standardized['standardized_unit_price'] = standardized['calculated_price_float']
 
 
-    return offer
+    return standardized
 
 # --- End of Helper Functions ---
 
+def _json_response(data: dict):
+    """jsonify(data), serialized by orjson when it is installed."""
+    if orjson is None:
+        return jsonify(data)
+    return Response(orjson.dumps(data), mimetype="application/json")
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -199,14 +267,18 @@ def process_brochure():
     if brochure_file and brochure_file.filename:
         filename = brochure_file.filename 
         pdf_filename_for_response = filename
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        try:
-            brochure_file.save(file_path)
-        except Exception as e:
-            return jsonify({"status": "error", "message": f"Could not save PDF: {str(e)}"}), 500
-
-        extracted_text = extract_text_from_pdf(file_path)
+        # The upload is parsed straight from memory; it only touches the disk when archiving is enabled
+        pdf_bytes = brochure_file.read()
+
+        if app.config['ARCHIVE_UPLOADS']:
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename) or "brochure.pdf")
+            try:
+                with open(file_path, "wb") as archived_file:
+                    archived_file.write(pdf_bytes)
+            except Exception as e:
+                return jsonify({"status": "error", "message": f"Could not save PDF: {str(e)}"}), 500
+
+        extracted_text = extract_text_from_pdf(pdf_bytes)
         if extracted_text is not None and extracted_text.strip():
             brochure_content_for_ai = extracted_text
         else:
@@ -227,22 +299,13 @@ def process_brochure():
         extraction_result['pdf_filename_processed'] = pdf_filename_for_response
         return jsonify(extraction_result), 500 
 
-    all_brochure_offers_str = extraction_result.get("ai_response", "[]")
-    all_brochure_offers = []
-    try:
-        all_brochure_offers = json.loads(all_brochure_offers_str)
-        if not isinstance(all_brochure_offers, list):
-            return jsonify({
-                "status": "error", 
-                "message": "AI successfully extracted brochure data, but it's not in the expected list format.",
-                "ai_raw_response": all_brochure_offers_str, 
-                "pdf_filename_processed": pdf_filename_for_response
-            }), 500
-    except json.JSONDecodeError:
+    # ai_client has already parsed the AI's JSON; use the offer list directly
+    all_brochure_offers = extraction_result.get("offers", [])
+    if not isinstance(all_brochure_offers, list) or not all(isinstance(offer, dict) for offer in all_brochure_offers):
         return jsonify({
             "status": "error", 
-            "message": "Failed to parse the extracted brochure offers from AI (not valid JSON).",
-            "ai_raw_response": all_brochure_offers_str, 
+            "message": "AI successfully extracted brochure data, but it's not in the expected list format.",
+            "ai_raw_response": extraction_result.get("ai_response"), 
             "pdf_filename_processed": pdf_filename_for_response
         }), 500
 
@@ -259,29 +322,36 @@ def process_brochure():
             "pdf_filename_processed": pdf_filename_for_response
         })
 
+    # Standardize every offer once, in place (the offers are this request's own copies); matched
+    # offers are looked up by identity below instead of being standardized a second time
+    standardized_all_brochure_offers = [standardize_offer_price(offer) for offer in all_brochure_offers]
+    standardized_by_id = {id(offer): standardized for offer, standardized in zip(all_brochure_offers, standardized_all_brochure_offers)}
+
     if not user_list_items: 
-        # Standardize all extracted offers even if user list is empty, for display
-        standardized_all_offers = [standardize_offer_price(offer.copy()) for offer in all_brochure_offers]
-        return jsonify({
+        # Standardized offers are still returned for display when the user list is empty
+        return _json_response({
             "status": "success_no_user_items",
             "message": "User grocery list is empty. Extracted and standardized all offers from brochure.",
-            "all_brochure_offers": standardized_all_offers,
+            "all_brochure_offers": standardized_all_brochure_offers,
             "user_shopping_list_matches": [], "unmatched_user_items": [],
             "pdf_filename_processed": pdf_filename_for_response
         })
 
+    # One batched matching call for the whole list instead of a round-trip per item
+    matches_by_item = match_items_to_brochure_offers(api_key, user_list_items, all_brochure_offers)
+
     for user_item in user_list_items:
-        if not user_item: 
-            continue
-        
-        match_result_offer = match_item_to_brochure_offers(api_key, user_item, all_brochure_offers)
+        match_result_offer = matches_by_item.get(user_item)
         
         if match_result_offer:
             if match_result_offer.get("status") == "error":
                 unmatched_user_items.append({"user_item": user_item, "match_error": match_result_offer.get('message', 'Unknown matching error')})
             else:
-                # Standardize the matched offer
-                standardized_matched_offer = standardize_offer_price(match_result_offer.copy()) # Use .copy()
+                # Reuse the standardized offer; only an offer not from this brochure list is standardized
+                # here, in place, since the matcher hands back the offer dicts of this request
+                standardized_matched_offer = standardized_by_id.get(id(match_result_offer))
+                if standardized_matched_offer is None:
+                    standardized_matched_offer = standardize_offer_price(match_result_offer)
                 matched_items_details.append({
                     "user_item": user_item,
                     "matched_offer": standardized_matched_offer 
@@ -289,32 +359,19 @@ def process_brochure():
         else:
             unmatched_user_items.append({"user_item": user_item, "match_error": None})
 
-    # Also standardize the full list of brochure offers for display
-    standardized_all_brochure_offers = [standardize_offer_price(offer.copy()) for offer in all_brochure_offers]
-
     # --- Step 3: Calculate Total Cost and Prepare Summary ---
-    total_cost_of_matched_items = 0.0
-    for item_match in matched_items_details:
-        offer = item_match.get("matched_offer", {})
-        # Use standardized_unit_price if it's a per-item price, otherwise calculated_price_float.
-        # This assumes quantity 1 for each user item.
-        # A more sophisticated approach would involve user-defined quantities and better logic
-        # to determine if standardized_unit_price is for a base unit (kg/L) or per piece.
-        # For now, if comparable_unit is Stück, Packung, Flasche, Bund, assume it's price per item.
-        # Otherwise, if it's kg/L, the 'standardized_unit_price' is per that base unit,
-        # and we'd ideally need a typical quantity for the item (e.g. 1kg Tomaten, 0.5kg Hackfleisch).
-        # As a simplification, we use 'calculated_price_float' which is the price for the pack/unit found.
-        
-        price_to_add = offer.get('calculated_price_float') # Default to the listed price for the item/pack
-        
-        # If the comparable unit is one of these, the standardized_unit_price is likely per single item
-        # (especially if items_in_pack from extract_quantity_and_unit_from_string was > 1
-        # or if condition_price_match resulted in price_per_item).
-        # However, calculated_price_float has already been adjusted for "X für Y" deals to be per item.
-        # So, calculated_price_float should generally be the price for the single unit/pack presented.
-        
-        if price_to_add is not None:
-            total_cost_of_matched_items += price_to_add
+    # Use standardized_unit_price if it's a per-item price, otherwise calculated_price_float.
+    # This assumes quantity 1 for each user item.
+    # A more sophisticated approach would involve user-defined quantities and better logic
+    # to determine if standardized_unit_price is for a base unit (kg/L) or per piece.
+    # For now, if comparable_unit is Stück, Packung, Flasche, Bund, assume it's price per item.
+    # Otherwise, if it's kg/L, the 'standardized_unit_price' is per that base unit,
+    # and we'd ideally need a typical quantity for the item (e.g. 1kg Tomaten, 0.5kg Hackfleisch).
+    # As a simplification, we use 'calculated_price_float' which is the price for the pack/unit found;
+    # it has already been adjusted for "X für Y" deals to be per item.
+    # fsum keeps the sum exact to the last bit, so long lists don't drift in the 2-decimal display.
+    matched_prices = (item_match["matched_offer"].get('calculated_price_float') for item_match in matched_items_details)
+    total_cost_of_matched_items = math.fsum(price for price in matched_prices if price is not None)
 
     shopping_summary = {
         "total_cost_of_matched_items": f"{total_cost_of_matched_items:.2f}",
@@ -331,7 +388,7 @@ def process_brochure():
         "shopping_summary": shopping_summary, # Added summary
         "pdf_filename_processed": pdf_filename_for_response
     }
-    return jsonify(final_response_data)
+    return _json_response(final_response_data)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get("PORT", 5000)))
@@ -1,32 +1,137 @@
 import fitz  # PyMuPDF
+import multiprocessing
 import os
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 
-def extract_text_from_pdf(pdf_path: str) -> str | None:
+PARALLEL_MIN_PAGES = 40 # Below this, handing pages to worker processes costs more than it saves
+MAX_PDF_WORKERS = min(4, os.cpu_count() or 1)
+
+PdfSource = str | bytes | bytearray | memoryview # A file path, or the PDF's bytes (e.g. an upload)
+
+def _open_pdf(source: PdfSource) -> fitz.Document:
+    """Opens a PDF from a file path or directly from in-memory bytes, without a disk round-trip."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+def iter_pdf_pages(source: PdfSource) -> Iterator[str]:
+    """
+    Yields the text of each page of a PDF in order, so callers can process a large
+    brochure page by page instead of holding all of its text at once.
+
+    Args:
+        source: The file path to the PDF, or its bytes.
+
+    Raises:
+        Whatever PyMuPDF raises for missing or corrupted files; the document is closed either way.
+    """
+    with _open_pdf(source) as document:
+        for page in document:
+            yield page.get_text("text") # "text" for plain text extraction
+
+# --- Parallel extraction ---
+# One worker pool per process, created on first use. Workers are started with forkserver (spawn
+# where it is unavailable), never by forking this process, which runs the AI client's event loop
+# thread and the web server's threads. PDF bytes reach the workers through one shared memory block
+# instead of being pickled into every task.
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=MAX_PDF_WORKERS, mp_context=multiprocessing.get_context(start_method))
+        return _pool
+
+def _discard_pool(broken_pool: ProcessPoolExecutor) -> None:
+    """Drops a pool whose workers died, so the next request starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken_pool:
+            _pool = None
+    broken_pool.shutdown(wait=False)
+
+def _extract_page_range(source: str | tuple[str, int], start: int, stop: int) -> list[str]:
+    """
+    Worker for parallel extraction: opens its own copy of the document and extracts pages [start, stop).
+    source is a file path, or (shared memory name, size) for a PDF held in memory.
+    """
+    if isinstance(source, str):
+        with _open_pdf(source) as document:
+            return [document[page_num].get_text("text") for page_num in range(start, stop)]
+    shm_name, size = source
+    try:
+        shm = shared_memory.SharedMemory(name=shm_name, track=False) # The parent owns and unlinks the block
+    except TypeError: # Python < 3.13 has no track parameter
+        shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        with shm.buf[:size] as view:
+            pdf_bytes = bytes(view) # PyMuPDF keeps a reference to its stream, so it gets its own copy
+        with _open_pdf(pdf_bytes) as document:
+            return [document[page_num].get_text("text") for page_num in range(start, stop)]
+    finally:
+        shm.close()
+
+def _extract_pages_parallel(source: PdfSource, page_count: int) -> list[str]:
+    """
+    Decodes page ranges in separate processes. PyMuPDF is not thread-safe and holds the GIL
+    while extracting, so threads cannot overlap the work; processes each with their own document can.
+    """
+    workers = min(MAX_PDF_WORKERS, page_count)
+    step = -(-page_count // workers) # Ceiling division, so every page falls into a range
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    shm = None
+    if isinstance(source, str):
+        task_source = source
+    else:
+        pdf_view = memoryview(source).cast("B")
+        shm = shared_memory.SharedMemory(create=True, size=max(len(pdf_view), 1))
+        shm.buf[:len(pdf_view)] = pdf_view
+        task_source = (shm.name, len(pdf_view))
+    pool = _get_pool()
+    try:
+        chunks = pool.map(_extract_page_range, [task_source] * len(ranges), *zip(*ranges))
+        return [page_text for chunk in chunks for page_text in chunk]
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+# --- End of parallel extraction ---
+
+def extract_text_from_pdf(source: PdfSource) -> str | None:
     """
     Extracts all text content from a given PDF file.
 
     Args:
-        pdf_path: The file path to the PDF.
+        source: The file path to the PDF, or the PDF's bytes (e.g. an uploaded file read into
+                memory), which are parsed directly without writing them to disk first.
 
     Returns:
-        A string containing all extracted text from the PDF,
+        A string containing all extracted text from the PDF (pages separated by newlines),
         or None if an error occurs (e.g., file not found, corrupted PDF).
     """
-    if not os.path.exists(pdf_path):
-        # print(f"Error: PDF file not found at {pdf_path}") # For server-side logging
-        return None
-    
+    # No os.path.exists() check first: fitz.open raises for a missing file, which is handled below
     try:
-        document = fitz.open(pdf_path)
-        full_text = []
-        for page_num in range(len(document)):
-            page = document.load_page(page_num)
-            full_text.append(page.get_text("text")) # "text" for plain text extraction
-        
-        document.close()
-        return "\n".join(full_text)
+        with _open_pdf(source) as document:
+            page_count = document.page_count
+        if MAX_PDF_WORKERS > 1 and page_count >= PARALLEL_MIN_PAGES:
+            return "\n".join(_extract_pages_parallel(source, page_count))
+        # str.join materializes the page generator into a list first, so all page texts are held once
+        # before the result is built; iterate iter_pdf_pages directly to process pages in bounded memory
+        return "\n".join(iter_pdf_pages(source))
     except Exception as e:
-        # print(f"Error processing PDF {pdf_path}: {e}") # For server-side logging
+        # print(f"Error processing PDF: {e}") # For server-side logging
         # Depending on the desired error handling, you might want to log the specific error
         # or return a more specific error message. For now, returning None indicates failure.
         return None
@@ -79,5 +184,3 @@ if __name__ == '__main__':
         print("Correctly handled non-existent PDF (returned None).")
     else:
         print(f"Incorrectly handled non-existent PDF (should have returned None, got: {non_existent_text}).")
-
-```
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+import ai_client
+
+OFFERS = [
+    {"product_name": "Bio Rispentomaten", "price": "1.99"},
+    {"product_name": "Frische Vollmilch 3.5%", "price": "1.15"},
+]
+
+
+@pytest.fixture
+def streamed_extraction(monkeypatch):
+    """Replaces the Gemini extraction with one that hands each offer to on_offer, as streaming does."""
+    async def fake_extract_offers(client, brochure_content, on_offer=None):
+        offers = [dict(offer) for offer in OFFERS]
+        for offer in offers:
+            await asyncio.sleep(0) # Let scheduled work run between offers, as between stream chunks
+            if on_offer is not None:
+                on_offer(offer)
+        return {"status": "success", "offers": offers, "ai_response": ""}
+
+    monkeypatch.setattr(ai_client, "_extract_offers", fake_extract_offers)
+    monkeypatch.setattr(ai_client, "_get_client", lambda api_key: object())
+    monkeypatch.setattr(ai_client, "_disk_cache", None)
+    monkeypatch.setattr(ai_client, "LOCAL_MATCHING", False)
+    ai_client._memory_cache.clear()
+    yield
+    ai_client._memory_cache.clear()
+
+
+@pytest.mark.skipif(ai_client.fuzz is None, reason="lexical matching needs rapidfuzz")
+def test_matching_scheduled_from_on_offer_runs_on_partial_results(streamed_extraction):
+    user_items = {"Bio Rispentomaten": "Tomaten", "Frische Vollmilch 3.5%": "Milch"}
+    match_tasks = []
+
+    def on_offer(offer):
+        # Only enqueue work: the callback runs on the loop that has to do the matching
+        matcher = ai_client.Matcher([offer], "test-key")
+        user_item = user_items[offer["product_name"]]
+        match_tasks.append(asyncio.get_running_loop().create_task(matcher.match_many_async([user_item])))
+
+    result = ai_client.get_ai_analysis("test-key", "", "Brochure text", on_offer=on_offer)
+    assert result["status"] == "success"
+
+    async def gather():
+        return await asyncio.gather(*match_tasks)
+
+    assert ai_client._run(gather()) == [[OFFERS[0]], [OFFERS[1]]]
+
+
+def test_sync_matching_from_on_offer_raises_instead_of_deadlocking(streamed_extraction):
+    errors = []
+
+    def on_offer(offer):
+        try:
+            ai_client.match_item_to_brochure_offers("test-key", "Tomaten", [offer])
+        except RuntimeError as e:
+            errors.append(e)
+
+    result = ai_client.get_ai_analysis("test-key", "", "Brochure text", on_offer=on_offer)
+    assert result["status"] == "success"
+    assert len(errors) == len(OFFERS)